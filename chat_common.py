@@ -0,0 +1,842 @@
+# chat_common.py
+# streamlit_app.py에서 쓰는 공용 상수/헬퍼 모음 (UI 코드는 streamlit_app.py에)
+
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import string
+import weakref
+from types import MappingProxyType
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Mapping
+
+import streamlit as st
+
+# requests/openai(httpx, pydantic 포함)는 무거워서 콜드 스타트를 늦춘다.
+# 실제 API를 부를 때 함수 안에서 import (sys.modules 캐시 덕에 두 번째부터는 공짜).
+if TYPE_CHECKING:
+    import httpx
+    import requests
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------
+# EmojiHub (Avatar용 사람 이모지)
+# ------------------------------
+EMOJI_API_BASE = "https://emojihub.yurace.pro/api"
+
+
+@st.cache_resource(show_spinner=False)
+def _http_session() -> "requests.Session":
+    """
+    EmojiHub 호출용 requests.Session 하나를 만들어서 재사용.
+    keep-alive + 커넥션 풀링 덕분에 매번 TCP/TLS 핸드셰이크를 다시 하지 않는다.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    session.headers.update({"Accept": "application/json"})
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=2, backoff_factor=0.2),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_avatar_emoji() -> str:
+    """
+    EmojiHub에서 'smileys and people' 카테고리의 랜덤 이모지 하나 가져오기.
+    HTML 코드로 리턴해서 그대로 렌더링.
+    실패하면 기본 이모지 사용.
+    """
+    try:
+        # EmojiHub docs 기준: /random/category/smileys-and-people
+        resp = _http_session().get(
+            f"{EMOJI_API_BASE}/random/category/smileys-and-people", timeout=5
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        html_codes = data.get("htmlCode") or []
+        if html_codes:
+            return "".join(html_codes)
+    except Exception:
+        pass
+    # 실패 시 기본 사람 이모지
+    return "🧑‍🎨"
+
+
+# ------------------------------
+# Role 정의 + ASCII 아트
+# ------------------------------
+_ROLE_DEFINITIONS: Dict[str, Dict[str, str]] = {
+    "Video Director 🎬": {
+        "short": "Analyzes mood, camera angle, lighting",
+        "system_prompt": (
+            "You are a professional film director. Always analyze ideas in terms of "
+            "visual storytelling — use camera movement, lighting, framing, editing, "
+            "and emotional tone to explain your thoughts. Describe concepts as if "
+            "you are planning a film scene or sequence."
+        ),
+        "example": "How can I shoot a dream sequence?",
+        "ascii": r"""
+  🎬 VIDEO DIRECTOR
+  ─────────────────────
+  [CAM]  ───►   [SCENE]
+  angles · lighting · mood
+""",
+    },
+    "Dance Instructor 💃": {
+        "short": "Suggests movement, rhythm, expression",
+        "system_prompt": (
+            "You are a contemporary dance instructor. You think in terms of movement, "
+            "rhythm, body weight, breath, and expression. When you answer, give concrete "
+            "movement ideas and describe how the body should feel."
+        ),
+        "example": "How can I express sadness through movement?",
+        "ascii": r"""
+  💃 DANCE INSTRUCTOR
+  ─────────────────────
+  1·2·3·4 · steps & flow
+  body · breath · emotion
+""",
+    },
+    "Fashion Stylist 👗": {
+        "short": "Explains color trends, materials, silhouette",
+        "system_prompt": (
+            "You are a professional fashion stylist. Give advice about silhouettes, "
+            "textures, materials, color harmony, and styling details. Imagine you are "
+            "preparing looks for a photoshoot or red carpet."
+        ),
+        "example": "What style fits a confident personality?",
+        "ascii": r"""
+  👗 FASHION STYLIST
+  ─────────────────────
+  color · fabric · shape
+  runway-ready outfits
+""",
+    },
+    "Acting Coach 🎭": {
+        "short": "Teaches emotion delivery, scene breakdown",
+        "system_prompt": (
+            "You are an acting coach. Help performers explore emotion, subtext, and "
+            "physicality. When you answer, break down the scene beat by beat and give "
+            "specific exercises or line readings."
+        ),
+        "example": "How to express fear naturally on stage?",
+        "ascii": r"""
+  🎭 ACTING COACH
+  ─────────────────────
+  beats · objectives · subtext
+  voice & body in sync
+""",
+    },
+    "Art Curator 🖼️": {
+        "short": "Interprets artwork, connects with data",
+        "system_prompt": (
+            "You are a museum art curator. Interpret artworks in terms of composition, "
+            "color, symbolism, and historical context. Connect visual elements to ideas, "
+            "emotions, and cultural references."
+        ),
+        "example": "How does this composition convey emotion?",
+        "ascii": r"""
+  🖼️ ART CURATOR
+  ─────────────────────
+  lines · color · symbols
+  stories behind the frame
+""",
+    },
+}
+
+# ASCII 아트의 앞뒤 개행은 import 시점에 한 번만 정리해 두고
+# (렌더 루프에서 매번 strip하지 않도록), 전체는 읽기 전용 뷰로 노출한다.
+# system 메시지 dict도 role마다 불변이므로 호출마다 새로 만들지 않고 여기서 고정.
+for _info in _ROLE_DEFINITIONS.values():
+    _info["ascii_stripped"] = _info["ascii"].strip("\n")
+    _info["system_msg"] = {"role": "system", "content": _info["system_prompt"]}
+
+ROLE_DEFINITIONS: Mapping[str, Dict[str, str]] = MappingProxyType(_ROLE_DEFINITIONS)
+
+# selectbox/multiselect에 바로 넘기는 상수 목록 (rerun마다 list() 재할당 방지)
+ROLE_NAMES: tuple = tuple(ROLE_DEFINITIONS)
+MODEL_NAMES: tuple = ("gpt-4.1-mini", "gpt-4.1")
+
+
+# ------------------------------
+# OpenAI 호출 함수
+# ------------------------------
+# API로 보낼 과거 대화의 최대 턴 수 (user+assistant 쌍 기준).
+# 전체 히스토리를 매번 보내면 프롬프트 토큰이 O(N)으로 늘어나 비용/지연이 커진다.
+MAX_TURNS = 8
+
+
+# 이벤트 루프별 클라이언트 캐시.
+# httpx의 keep-alive 커넥션은 자신을 만든 루프에 묶이는데, asyncio.run()은
+# 클릭마다 새 루프를 만든다. 루프를 넘나들며 클라이언트를 재사용하면 이전
+# 루프의 풀링된 커넥션이 다음 루프 첫 요청에서 "Event loop is closed"로 죽고,
+# 그 실패를 tenacity가 transient로 재시도하면서 클릭마다 백오프 지연이 붙는다.
+# 그래서 전역 싱글톤 대신 (루프 → 클라이언트) 캐시를 쓴다 — 같은 클릭 안의
+# 호출들은 커넥션을 공유하고, 루프가 사라지면 WeakKeyDictionary 엔트리도
+# 같이 사라진다. (세션 스레드마다 루프가 다르므로 스레드 간 공유 문제도 없음)
+_CLIENTS_BY_LOOP: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _openai_http_client() -> "httpx.AsyncClient":
+    """
+    현재 실행 중인 루프 전용 httpx.AsyncClient.
+    같은 클릭(=같은 루프) 안의 임베딩/chat/variants/병렬 role 호출이
+    HTTP/2 멀티플렉싱으로 TLS 세션 하나를 나눠 쓴다.
+    """
+    import httpx
+
+    cache = _CLIENTS_BY_LOOP.setdefault(asyncio.get_running_loop(), {})
+    client = cache.get("_http")
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            timeout=httpx.Timeout(connect=5.0, read=60.0, write=10.0, pool=5.0),
+        )
+        cache["_http"] = client
+    return client
+
+
+def get_openai_client(api_key: str) -> "AsyncOpenAI":
+    """
+    현재 루프 + api_key당 AsyncOpenAI 클라이언트 하나를 재사용.
+    타임아웃/재시도가 명시되어 업스트림이 멈춰도 스크립트 스레드가
+    무한정 붙잡히지 않는다 (스트리밍이라 read는 넉넉하게).
+    실행 중인 이벤트 루프 안에서만 호출할 것.
+    """
+    from openai import AsyncOpenAI
+
+    cache = _CLIENTS_BY_LOOP.setdefault(asyncio.get_running_loop(), {})
+    client = cache.get(api_key)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=api_key,
+            # 재시도 정책은 tenacity(_chat_retrying)가 가지므로 SDK 쪽은 끈다
+            # (안 그러면 SDK 2회 × tenacity 3회로 재시도가 곱해진다)
+            max_retries=0,
+            http_client=_openai_http_client(),
+        )
+        cache[api_key] = client
+    return client
+
+
+def _is_quota_error(exc: BaseException) -> bool:
+    """
+    크레딧 소진(insufficient_quota) 429인지 타입 + 에러 코드로 판별.
+    str(exc)는 응답 JSON 바디 전체를 문자열화하므로 substring 매칭 대신
+    SDK가 파싱해 둔 code 필드를 본다 (포맷이 SDK 버전에 따라 변해도 안전).
+    """
+    from openai import RateLimitError
+
+    return (
+        isinstance(exc, RateLimitError)
+        and getattr(exc, "code", None) == "insufficient_quota"
+    )
+
+
+def _should_retry_chat(exc: BaseException) -> bool:
+    """일시적 에러(429/타임아웃/커넥션)만 재시도. quota 소진은 즉시 mock으로."""
+    from openai import APIConnectionError, APITimeoutError, RateLimitError
+
+    if isinstance(exc, RateLimitError):
+        return not _is_quota_error(exc)
+    return isinstance(exc, (APITimeoutError, APIConnectionError))
+
+
+def _chat_retrying():
+    """create 호출용 tenacity 정책: 최대 3회, 지터 있는 지수 백오프."""
+    from tenacity import (
+        AsyncRetrying,
+        retry_if_exception,
+        stop_after_attempt,
+        wait_random_exponential,
+    )
+
+    return AsyncRetrying(
+        stop=stop_after_attempt(3),
+        wait=wait_random_exponential(min=1, max=30),
+        retry=retry_if_exception(_should_retry_chat),
+        reraise=True,
+    )
+
+
+def append_message(msg: Dict[str, str]) -> None:
+    """
+    히스토리에 메시지 추가.
+    - 렌더용 HTML을 미리 조립해 msg["_html"]에 캐싱
+    - API용 {"role", "content"} 사본을 api_history에 같이 쌓아서
+      매 클릭마다 전체 히스토리를 dict로 다시 변환하지 않게 한다 (O(1) append)
+    """
+    message_history_html(msg)
+    st.session_state.chat_history.append(msg)
+    st.session_state.api_history.append(
+        {"role": msg["role"], "content": msg["content"]}
+    )
+
+
+def windowed_history() -> List[Dict[str, str]]:
+    """
+    API에 보낼 과거 대화: api_history의 최근 MAX_TURNS 쌍 슬라이스.
+    호출 경로가 어디든 프롬프트 길이가 바운드되도록 여기 한 곳에서 자른다.
+    """
+    return st.session_state.api_history[-2 * MAX_TURNS :]
+
+
+# 출력 토큰은 직렬로 생성되므로 답변 지연은 max_tokens에 거의 선형이다.
+# 기본 한도를 모델 최대치 대신 512로 잡아 긴 답변의 벽시계 시간을 바운드한다.
+DEFAULT_MAX_TOKENS = 512
+DEFAULT_TEMPERATURE = 0.7
+
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache() -> Dict[str, str]:
+    """
+    완성된 답변의 exact-match 캐시.
+    같은 (api_key, model, system_prompt, user_message, history) 조합으로
+    'Generate Response'를 다시 누르면 LLM 왕복 없이 바로 반환한다.
+    스트리밍 제너레이터는 st.cache_data로 감쌀 수 없어서 dict를 직접 관리한다.
+    """
+    return {}
+
+
+# exact-match 캐시 최대 엔트리 수 (초과 시 가장 오래된 것부터 밀어냄)
+ANSWER_CACHE_MAX_ENTRIES = 256
+
+
+def cache_answer(cache: Dict[str, str], key: str, answer: str) -> None:
+    """
+    답변을 exact-match 캐시에 저장.
+    mock 답변은 건너뛰고, dict의 삽입 순서를 이용해 FIFO로 크기를 바운드한다
+    (서버가 오래 떠 있어도 캐시가 무한히 자라지 않도록).
+    """
+    if not answer or answer.startswith("[Mock response]"):
+        return
+    while len(cache) >= ANSWER_CACHE_MAX_ENTRIES:
+        cache.pop(next(iter(cache)))
+    cache[key] = answer
+
+
+def make_answer_cache_key(
+    api_key: str,
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    history: List[Dict[str, str]],
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    temperature: float = DEFAULT_TEMPERATURE,
+) -> str:
+    """호출 입력 전체를 blake2b로 해시한 캐시 키 (api_key는 해시에만 들어감)."""
+    payload = json.dumps(
+        [api_key, model, system_prompt, user_message, history, max_tokens, temperature],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+# ------------------------------
+# 의미(semantic) 캐시
+# ------------------------------
+# exact-match 캐시는 글자가 하나만 달라도 미스다. 비슷한 질문
+# ("꿈 장면을 어떻게 찍죠?" vs "꿈 장면 촬영하는 법?")은 임베딩 코사인
+# 유사도로 잡아서 completion 왕복을 통째로 건너뛴다.
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+
+def _semantic_cache_entries(role_name: str, model: str) -> list:
+    """(role, model)별 (질문 임베딩, 답변) 리스트. 세션 상태에 보관."""
+    caches = st.session_state.setdefault("_semantic_cache", {})
+    return caches.setdefault((role_name, model), [])
+
+
+async def semantic_cache_lookup(
+    api_key: str, model: str, role_name: str, user_message: str
+):
+    """
+    user_message를 임베딩해서 유사 질문의 캐시된 답변을 찾는다.
+    반환: (answer | None, embedding | None).
+    일시적인 API 에러(커넥션/타임아웃/429)는 (None, None)으로 fail-open —
+    캐시는 최적화일 뿐이라 본 completion 호출을 막으면 안 된다.
+    단, 조용히 죽은 캐시는 눈에 안 보이므로 삼킨 예외는 로그로 남기고,
+    그 외 예외(잘못된 키, 버그 등)는 그대로 전파한다.
+    """
+    if st.session_state.get("quota_exhausted"):
+        return None, None
+    import numpy as np  # lazy import (콜드 스타트에서 제외)
+    from openai import APIConnectionError, APITimeoutError, OpenAIError, RateLimitError
+
+    try:
+        client = get_openai_client(api_key)
+        resp = await client.embeddings.create(
+            model=EMBEDDING_MODEL, input=user_message
+        )
+        emb = np.asarray(resp.data[0].embedding, dtype=np.float32)
+    except (APIConnectionError, APITimeoutError, RateLimitError) as e:
+        logger.warning("Semantic cache lookup failed, falling through: %s", e)
+        return None, None
+    except OpenAIError as e:
+        # 키 오류 같은 비일시적 에러는 fail-open 대상이 아니다 — chat 경로와
+        # 같은 형태로 올려서 UI가 st.error로 보여주게 한다
+        raise RuntimeError(f"OpenAI API error: {e}") from e
+
+    entries = _semantic_cache_entries(role_name, model)
+    if entries:
+        mat = np.stack([e for e, _ in entries])
+        # BLAS 한 번으로 저장된 전체 임베딩과의 코사인 유사도 계산
+        sims = (mat @ emb) / (np.linalg.norm(mat, axis=1) * np.linalg.norm(emb))
+        best = int(sims.argmax())
+        if sims[best] > SEMANTIC_CACHE_THRESHOLD:
+            return entries[best][1], emb
+    return None, emb
+
+
+def semantic_cache_store(role_name: str, model: str, embedding, answer: str) -> None:
+    """새 (질문 임베딩, 답변) 쌍을 저장. 임베딩 실패분과 mock/빈 답변은 제외."""
+    if embedding is None or not answer or answer.startswith("[Mock response]"):
+        return
+    _semantic_cache_entries(role_name, model).append((embedding, answer))
+
+
+# quota 부족 시 사용하는 모의 답변 (매 호출마다 리터럴을 다시 만들지 않도록 상수로)
+MOCK_RESPONSE = (
+    "[Mock response]\n"
+    "지금은 OpenAI 크레딧이 부족해서 실제 모델을 호출할 수 없습니다.\n"
+    "대신, 이 역할이라면 이런 식으로 생각해 볼 수 있어요:\n\n"
+    "- 장면의 감정, 구도, 리듬을 분리해서 하나씩 분석해 보기\n"
+    "- 관객이 느끼길 원하는 감정을 먼저 정하고, 거기에 맞게 요소를 조합하기\n"
+    "- 실제 촬영/퍼포먼스 전에 짧은 스케치를 여러 개 만들어 비교해 보기\n"
+)
+
+
+# 알려진 role의 system 메시지 dict를 prompt 텍스트로 역인덱싱해 두면
+# build_messages가 호출마다 dict를 새로 만들지 않아도 된다.
+_SYSTEM_MSG_BY_PROMPT: Dict[str, Dict[str, str]] = {
+    info["system_prompt"]: info["system_msg"] for info in _ROLE_DEFINITIONS.values()
+}
+
+
+def build_messages(
+    system_prompt: str,
+    user_message: str,
+    history: List[Dict[str, str]] | None = None,
+) -> List[Dict[str, str]]:
+    """system + history + user를 리스트 리터럴 하나로 조립 (resize 없음)."""
+    system_msg = _SYSTEM_MSG_BY_PROMPT.get(system_prompt) or {
+        "role": "system",
+        "content": system_prompt,
+    }
+    return [system_msg, *(history or ()), {"role": "user", "content": user_message}]
+
+
+async def call_openai_chat(
+    api_key: str,
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    history: List[Dict[str, str]] | None = None,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    temperature: float = DEFAULT_TEMPERATURE,
+) -> AsyncIterator[str]:
+    """
+    OpenAI Chat Completions API를 stream=True로 호출해서 토큰 델타를 하나씩 yield.
+    async라서 아바타 fetch 같은 다른 I/O와 같은 이벤트 루프에서 겹쳐 돌 수 있다.
+    history는 [{"role": "user"/"assistant", "content": "..."}] 리스트.
+    """
+    from openai import OpenAIError
+
+    # 이미 quota 부족이 확인된 세션이면 API 왕복 없이 바로 mock
+    if st.session_state.get("quota_exhausted"):
+        yield MOCK_RESPONSE
+        return
+
+    client = get_openai_client(api_key)
+    messages = build_messages(system_prompt, user_message, history)
+
+    try:
+        async for attempt in _chat_retrying():
+            with attempt:
+                stream = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content or ""
+            if delta:
+                yield delta
+    except OpenAIError as e:
+        # quota 에러일 때는 모의 답변으로 대체 + 이후 호출 short-circuit용 플래그
+        if _is_quota_error(e):
+            st.session_state.quota_exhausted = True
+            yield MOCK_RESPONSE
+            return
+        raise RuntimeError(f"OpenAI API error: {e}") from e
+
+
+async def call_openai_chat_variants(
+    api_key: str,
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    history: List[Dict[str, str]] | None = None,
+    n: int = 1,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    temperature: float = DEFAULT_TEMPERATURE,
+) -> List[str]:
+    """
+    같은 프롬프트로 답변 변형 n개를 "요청 한 번"으로 받아온다.
+    n개를 따로 부르면 입력 토큰도 n번 과금되고 RPM도 n배로 쓰지만,
+    n= 파라미터는 공유 프리픽스를 한 번만 보내고 요청 수도 1이다.
+    """
+    from openai import OpenAIError
+
+    if st.session_state.get("quota_exhausted"):
+        return [MOCK_RESPONSE]
+
+    client = get_openai_client(api_key)
+    messages = build_messages(system_prompt, user_message, history)
+
+    try:
+        async for attempt in _chat_retrying():
+            with attempt:
+                completion = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    n=n,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+        return [c.message.content.strip() for c in completion.choices]
+    except OpenAIError as e:
+        if _is_quota_error(e):
+            st.session_state.quota_exhausted = True
+            return [MOCK_RESPONSE]
+        raise RuntimeError(f"OpenAI API error: {e}") from e
+
+
+async def call_openai_chat_once(
+    api_key: str,
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    history: List[Dict[str, str]] | None = None,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    temperature: float = DEFAULT_TEMPERATURE,
+) -> str:
+    """
+    비스트리밍 단발 호출 (multi-role 병렬용).
+    스트리밍 제너레이터를 그대로 소비해서 에러/mock 처리 로직을 공유한다.
+    """
+    parts = [
+        token
+        async for token in call_openai_chat(
+            api_key=api_key,
+            model=model,
+            system_prompt=system_prompt,
+            user_message=user_message,
+            history=history,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+    ]
+    return "".join(parts).strip()
+
+
+async def ask_roles(
+    api_key: str,
+    model: str,
+    user_message: str,
+    history: List[Dict[str, str]] | None = None,
+    roles: List[str] | None = None,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    temperature: float = DEFAULT_TEMPERATURE,
+) -> Dict[str, str]:
+    """
+    선택된 role들(기본: 전체)에게 같은 질문을 "동시에" 물어본다.
+    asyncio.gather로 role별 호출을 겹쳐서 N×가 아니라 ~1× 지연이 되도록.
+    exact-match 답변 캐시도 role별로 그대로 적용된다.
+    """
+    if roles is None:
+        roles = ROLE_NAMES
+    sem = asyncio.Semaphore(5)
+    answer_cache = get_answer_cache()
+
+    async def _one(role: str) -> tuple[str, str]:
+        info = ROLE_DEFINITIONS[role]
+        cache_key = make_answer_cache_key(
+            api_key,
+            model,
+            info["system_prompt"],
+            user_message,
+            history or [],
+            max_tokens,
+            temperature,
+        )
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            return role, cached
+        async with sem:
+            answer = await call_openai_chat_once(
+                api_key,
+                model,
+                info["system_prompt"],
+                user_message,
+                history,
+                max_tokens,
+                temperature,
+            )
+        cache_answer(answer_cache, cache_key, answer)
+        return role, answer
+
+    results = await asyncio.gather(*(_one(role) for role in roles))
+    return dict(results)
+
+
+# ------------------------------
+# 말풍선 UI용 CSS
+# ------------------------------
+# 모듈 상수로 한 번만 만들어 둔다. (매 rerun마다 리터럴을 다시 조립하지 않음)
+# Streamlit은 rerun에서 emit되지 않은 요소를 지워버리므로 markdown 호출 자체는
+# 매 rerun 유지해야 한다 — 상수라서 서버 쪽 비용은 문자열 전송뿐이다.
+CHAT_CSS = """
+<style>
+.chat-container {
+  display: flex;
+  margin-bottom: 0.5rem;
+}
+
+.chat-bubble {
+  padding: 0.6rem 0.9rem;
+  border-radius: 12px;
+  max-width: 100%;
+  word-wrap: break-word;
+  font-size: 0.95rem;
+}
+
+.chat-bubble-inner {
+  display: flex;
+  gap: 0.6rem;
+  align-items: flex-start;
+}
+
+.chat-avatar {
+  width: 2rem;
+  height: 2rem;
+  display: flex;
+  align-items: center;
+  justify-content: center;
+  font-size: 1.7rem;
+}
+
+.chat-content {
+  flex: 1;
+}
+
+.chat-user {
+  justify-content: flex-end;
+}
+
+.chat-user .chat-bubble {
+  background-color: #DCF8C6;
+  border-bottom-right-radius: 2px;
+}
+
+.chat-bot {
+  justify-content: flex-start;
+}
+
+.chat-bot .chat-bubble {
+  background-color: #F1F0F0;
+  border-bottom-left-radius: 2px;
+}
+
+.chat-role-header {
+  font-size: 0.8rem;
+  color: #555;
+  margin-bottom: 0.15rem;
+  font-weight: 600;
+}
+
+.chat-ascii {
+  font-family: "Courier New", monospace;
+  font-size: 0.7rem;
+  white-space: pre;
+  margin-bottom: 0.25rem;
+  color: #444;
+}
+
+/* history 영역: 봇 말풍선 높이 고정 + overflow hidden
+   (아스키 아트 3~4줄은 보이도록 넉넉하게 설정) */
+.chat-history-bot .chat-bubble {
+  max-height: 130px;
+  overflow: hidden;
+}
+
+/* st.expander 대신 쓰는 네이티브 <details> (서버 쪽 위젯 비용 0) */
+details {
+  margin: 0 0 0.5rem 0;
+}
+
+details > summary {
+  cursor: pointer;
+  font-size: 0.8rem;
+  color: #555;
+}
+
+details .chat-bubble {
+  background-color: #F1F0F0;
+  margin-top: 0.25rem;
+  white-space: pre-wrap;
+}
+</style>
+"""
+
+
+# ------------------------------
+# 말풍선 템플릿 + HTML 빌더
+# ------------------------------
+# role별 정적인 부분(ASCII 아트, role 이름)은 import 시점에 한 번만 채워 넣고,
+# 매 rerun에는 동적인 ${text}/${emoji_html}만 string.Template.substitute로
+# 끼워 넣는다. (str.format과 달리 포맷 스펙 파싱 없이 단순 치환만 한다)
+USER_BUBBLE_TEMPLATE = string.Template("""
+<div class="chat-container chat-user">
+  <div class="chat-bubble">
+    ${text}
+  </div>
+</div>
+""")
+
+_BOT_BUBBLE_MAIN_BASE = """
+<div class="chat-container chat-bot">
+  <div class="chat-bubble">
+    <div class="chat-bubble-inner">
+      <div class="chat-avatar">${{emoji_html}}</div>
+      <div class="chat-content">
+        <div class="chat-role-header">{role_name}</div>
+        <div class="chat-ascii">{ascii}</div>
+        <div>${{text}}</div>
+      </div>
+    </div>
+  </div>
+</div>
+"""
+
+_BOT_BUBBLE_HISTORY_BASE = """
+<div class="chat-container chat-bot chat-history-bot">
+  <div class="chat-bubble">
+    <div class="chat-bubble-inner">
+      <div class="chat-avatar">${{emoji_html}}</div>
+      <div class="chat-content">
+        <div class="chat-role-header">{role_name}</div>
+        <div class="chat-ascii">{ascii}</div>
+      </div>
+    </div>
+  </div>
+</div>
+"""
+
+BOT_BUBBLE_MAIN_TEMPLATES: Dict[str, string.Template] = {
+    role: string.Template(
+        _BOT_BUBBLE_MAIN_BASE.format(role_name=role, ascii=info["ascii_stripped"])
+    )
+    for role, info in ROLE_DEFINITIONS.items()
+}
+
+_BOT_BUBBLE_HISTORY_TEMPLATES: Dict[str, string.Template] = {
+    role: string.Template(
+        _BOT_BUBBLE_HISTORY_BASE.format(role_name=role, ascii=info["ascii_stripped"])
+    )
+    for role, info in ROLE_DEFINITIONS.items()
+}
+
+# 히스토리 blob에서 긴 답변을 접어 두는 네이티브 <details> 블록.
+# st.expander와 달리 서버 쪽 위젯 비용이 없다.
+DETAILS_TEMPLATE = string.Template("""
+<details>
+  <summary>Show full answer</summary>
+  <div class="chat-bubble">${text}</div>
+</details>
+""")
+
+
+def escape_chat_html(text: str) -> str:
+    """말풍선 HTML에 끼워 넣기 전에 이스케이프 (붙여넣은 <script> 같은 것 방지)."""
+    return html.escape(text).replace("\n", "<br>")
+
+
+def message_history_html(msg: Dict[str, str]) -> str:
+    """
+    메시지 하나의 히스토리용 HTML.
+    내용은 append 이후 불변이므로 처음 만든 결과를 msg["_html"]에 캐싱해 두고,
+    이후 rerun에서는 포매팅 없이 그대로 반환한다.
+    """
+    cached = msg.get("_html")
+    if cached is not None:
+        return cached
+
+    if msg["role"] == "user":
+        html_block = USER_BUBBLE_TEMPLATE.substitute(
+            text=escape_chat_html(msg["content"])
+        )
+    else:
+        # 말풍선(아바타 + Role header + ASCII 아트) + 접힌 전체 답변
+        html_block = (
+            _BOT_BUBBLE_HISTORY_TEMPLATES[msg["role_name"]].substitute(
+                emoji_html=msg.get("avatar", "🧑‍🎨")
+            )
+            + DETAILS_TEMPLATE.substitute(text=escape_chat_html(msg["content"]))
+        )
+    msg["_html"] = html_block
+    return html_block
+
+
+def build_history_html(chat_history: List[Dict[str, str]]) -> str:
+    """
+    히스토리 전체를 HTML 문자열 하나로 조립.
+    메시지마다 st.markdown을 호출하면 N개의 ForwardMsg 프레임이 나가므로,
+    말풍선 + <details> 블록을 전부 이어붙여 한 번에 emit한다.
+    """
+    return "\n".join(message_history_html(msg) for msg in chat_history)
+
+
+def incremental_history_html() -> str:
+    """
+    히스토리 blob의 증분(incremental) 버전.
+    rerun마다 전체를 다시 join하는 대신, 마지막 렌더 이후 추가된 메시지만
+    기존 blob 뒤에 이어붙인다. (rerun당 O(Δ), 전체 O(N) 아님)
+    Clear history 시에는 reset_history_cache()로 초기화.
+    """
+    chat_history = st.session_state.chat_history
+    blob = st.session_state.setdefault("_rendered_html_cache", "")
+    count = st.session_state.setdefault("_rendered_count", 0)
+
+    # 히스토리가 줄어든 경우(클리어 등)는 처음부터 다시
+    if count > len(chat_history):
+        blob, count = "", 0
+
+    new_parts = [message_history_html(msg) for msg in chat_history[count:]]
+    if new_parts:
+        blob = "\n".join(([blob] if blob else []) + new_parts)
+        st.session_state._rendered_html_cache = blob
+    st.session_state._rendered_count = len(chat_history)
+    return blob
+
+
+def reset_history_cache():
+    """Clear history 시 증분 렌더 캐시도 같이 비운다."""
+    st.session_state._rendered_html_cache = ""
+    st.session_state._rendered_count = 0
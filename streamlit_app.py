@@ -1,314 +1,365 @@
 # streamlit_app.py
 # Role-based Creative Chatbot (Bubble UI + EmojiHub avatar + compact history)
+# 공용 상수/헬퍼는 chat_common.py에, 여기는 Streamlit UI만.
 
-import os
-from typing import List, Dict
+import asyncio
+from typing import Dict, List
 
-import requests
 import streamlit as st
-from openai import OpenAI, OpenAIError
 
+from chat_common import (
+    BOT_BUBBLE_MAIN_TEMPLATES,
+    ask_roles,
+    CHAT_CSS,
+    MODEL_NAMES,
+    ROLE_DEFINITIONS,
+    ROLE_NAMES,
+    cache_answer,
+    call_openai_chat,
+    call_openai_chat_variants,
+    escape_chat_html,
+    get_answer_cache,
+    get_avatar_emoji,
+    make_answer_cache_key,
+    append_message,
+    incremental_history_html,
+    reset_history_cache,
+    semantic_cache_lookup,
+    semantic_cache_store,
+    windowed_history,
+)
 
-# ------------------------------
-# 0. EmojiHub (Avatar용 사람 이모지)
-# ------------------------------
-EMOJI_API_BASE = "https://emojihub.yurace.pro/api"
 
-
-def get_avatar_emoji() -> str:
-    """
-    EmojiHub에서 'smileys and people' 카테고리의 랜덤 이모지 하나 가져오기.
-    HTML 코드로 리턴해서 그대로 렌더링.
-    실패하면 기본 이모지 사용.
-    """
-    try:
-        # EmojiHub docs 기준: /random/category/smileys-and-people
-        resp = requests.get(
-            f"{EMOJI_API_BASE}/random/category/smileys-and-people", timeout=5
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        html_codes = data.get("htmlCode") or []
-        if html_codes:
-            return "".join(html_codes)
-    except Exception:
-        pass
-    # 실패 시 기본 사람 이모지
-    return "🧑‍🎨"
+def inject_chat_css():
+    st.markdown(CHAT_CSS, unsafe_allow_html=True)
 
 
-# ------------------------------
-# 1. Role 정의 + ASCII 아트
-# ------------------------------
-ROLE_DEFINITIONS: Dict[str, Dict[str, str]] = {
-    "Video Director 🎬": {
-        "short": "Analyzes mood, camera angle, lighting",
-        "system_prompt": (
-            "You are a professional film director. Always analyze ideas in terms of "
-            "visual storytelling — use camera movement, lighting, framing, editing, "
-            "and emotional tone to explain your thoughts. Describe concepts as if "
-            "you are planning a film scene or sequence."
-        ),
-        "example": "How can I shoot a dream sequence?",
-        "ascii": r"""
-  🎬 VIDEO DIRECTOR
-  ─────────────────────
-  [CAM]  ───►   [SCENE]
-  angles · lighting · mood
-""",
-    },
-    "Dance Instructor 💃": {
-        "short": "Suggests movement, rhythm, expression",
-        "system_prompt": (
-            "You are a contemporary dance instructor. You think in terms of movement, "
-            "rhythm, body weight, breath, and expression. When you answer, give concrete "
-            "movement ideas and describe how the body should feel."
-        ),
-        "example": "How can I express sadness through movement?",
-        "ascii": r"""
-  💃 DANCE INSTRUCTOR
-  ─────────────────────
-  1·2·3·4 · steps & flow
-  body · breath · emotion
-""",
-    },
-    "Fashion Stylist 👗": {
-        "short": "Explains color trends, materials, silhouette",
-        "system_prompt": (
-            "You are a professional fashion stylist. Give advice about silhouettes, "
-            "textures, materials, color harmony, and styling details. Imagine you are "
-            "preparing looks for a photoshoot or red carpet."
-        ),
-        "example": "What style fits a confident personality?",
-        "ascii": r"""
-  👗 FASHION STYLIST
-  ─────────────────────
-  color · fabric · shape
-  runway-ready outfits
-""",
-    },
-    "Acting Coach 🎭": {
-        "short": "Teaches emotion delivery, scene breakdown",
-        "system_prompt": (
-            "You are an acting coach. Help performers explore emotion, subtext, and "
-            "physicality. When you answer, break down the scene beat by beat and give "
-            "specific exercises or line readings."
-        ),
-        "example": "How to express fear naturally on stage?",
-        "ascii": r"""
-  🎭 ACTING COACH
-  ─────────────────────
-  beats · objectives · subtext
-  voice & body in sync
-""",
-    },
-    "Art Curator 🖼️": {
-        "short": "Interprets artwork, connects with data",
-        "system_prompt": (
-            "You are a museum art curator. Interpret artworks in terms of composition, "
-            "color, symbolism, and historical context. Connect visual elements to ideas, "
-            "emotions, and cultural references."
+def render_bot_bubble_main(text: str, role_name: str, emoji_html: str):
+    """메인 영역의 최신 답변용 (전체 텍스트 다 보여줌)."""
+    st.markdown(
+        BOT_BUBBLE_MAIN_TEMPLATES[role_name].substitute(
+            text=escape_chat_html(text), emoji_html=emoji_html
         ),
-        "example": "How does this composition convey emotion?",
-        "ascii": r"""
-  🖼️ ART CURATOR
-  ─────────────────────
-  lines · color · symbols
-  stories behind the frame
-""",
-    },
-}
+        unsafe_allow_html=True,
+    )
 
 
 # ------------------------------
-# 2. OpenAI 호출 함수
+# Streamlit UI
 # ------------------------------
-def call_openai_chat(
+@st.fragment
+def latest_panel(
     api_key: str,
-    model: str,
-    system_prompt: str,
-    user_message: str,
-    history: List[Dict[str, str]] | None = None,
-) -> str:
+    model_name: str,
+    role_name: str,
+    role_info: Dict[str, str],
+    compare_roles: List[str],
+    n_variants: int,
+    max_tokens: int,
+    temperature: float,
+):
     """
-    OpenAI Chat Completions API를 호출해서 답변 텍스트만 반환.
-    history는 [{"role": "user"/"assistant", "content": "..."}] 리스트.
+    입력 + Generate 버튼 + 최신 답변 영역.
+    fragment라서 버튼/텍스트 입력 조작은 이 영역만 다시 돌린다.
+    히스토리가 바뀌었을 때만 st.rerun()으로 전체 rerun을 트리거한다.
     """
-    client = OpenAI(api_key=api_key)
+    st.title("🎭 Role-based Creative Chatbot")
+    st.write("Select a creative role on the left and ask your question below.")
 
-    messages = [{"role": "system", "content": system_prompt}]
-    if history:
-        messages.extend(history)
-    messages.append({"role": "user", "content": user_message})
+    example_text = role_info["example"]
+    # text_area + 버튼 대신 chat_input: 타이핑 중에는 rerun이 없고 제출 시에만
+    # 스크립트가 돈다. placeholder는 제출되지 않으므로 "e.g.," 검사도 불필요.
+    user_input = st.chat_input(f"Ask as {role_name}... (e.g., {example_text})")
 
-    try:
-        completion = client.chat.completions.create(
-            model=model,
-            messages=messages,
-        )
-        return completion.choices[0].message.content.strip()
-    except OpenAIError as e:
-        # quota 에러일 때는 모의 답변으로 대체
-        if "insufficient_quota" in str(e):
-            return (
-                "[Mock response]\n"
-                "지금은 OpenAI 크레딧이 부족해서 실제 모델을 호출할 수 없습니다.\n"
-                "대신, 이 역할이라면 이런 식으로 생각해 볼 수 있어요:\n\n"
-                "- 장면의 감정, 구도, 리듬을 분리해서 하나씩 분석해 보기\n"
-                "- 관객이 느끼길 원하는 감정을 먼저 정하고, 거기에 맞게 요소를 조합하기\n"
-                "- 실제 촬영/퍼포먼스 전에 짧은 스케치를 여러 개 만들어 비교해 보기\n"
-            )
-        raise RuntimeError(f"OpenAI API error: {e}") from e
-
-
-# ------------------------------
-# 3. 말풍선 UI용 CSS
-# ------------------------------
-def inject_chat_css():
-    st.markdown(
-        """
-<style>
-.chat-container {
-  display: flex;
-  margin-bottom: 0.5rem;
-}
-
-.chat-bubble {
-  padding: 0.6rem 0.9rem;
-  border-radius: 12px;
-  max-width: 100%;
-  word-wrap: break-word;
-  font-size: 0.95rem;
-}
-
-.chat-bubble-inner {
-  display: flex;
-  gap: 0.6rem;
-  align-items: flex-start;
-}
-
-.chat-avatar {
-  width: 2rem;
-  height: 2rem;
-  display: flex;
-  align-items: center;
-  justify-content: center;
-  font-size: 1.7rem;
-}
-
-.chat-content {
-  flex: 1;
-}
-
-.chat-user {
-  justify-content: flex-end;
-}
-
-.chat-user .chat-bubble {
-  background-color: #DCF8C6;
-  border-bottom-right-radius: 2px;
-}
-
-.chat-bot {
-  justify-content: flex-start;
-}
-
-.chat-bot .chat-bubble {
-  background-color: #F1F0F0;
-  border-bottom-left-radius: 2px;
-}
-
-.chat-role-header {
-  font-size: 0.8rem;
-  color: #555;
-  margin-bottom: 0.15rem;
-  font-weight: 600;
-}
-
-.chat-ascii {
-  font-family: "Courier New", monospace;
-  font-size: 0.7rem;
-  white-space: pre;
-  margin-bottom: 0.25rem;
-  color: #444;
-}
-
-/* history 영역: 봇 말풍선 높이 고정 + overflow hidden
-   (아스키 아트 3~4줄은 보이도록 넉넉하게 설정) */
-.chat-history-bot .chat-bubble {
-  max-height: 130px;
-  overflow: hidden;
-}
-</style>
-        """,
-        unsafe_allow_html=True,
-    )
+    if user_input:
+        if not api_key:
+            st.error("먼저 왼쪽에서 OpenAI API Key를 입력하세요.")
+        else:
+            clean_input = user_input.strip()
+            if not clean_input:
+                st.warning("질문을 입력한 뒤 전송해 주세요.")
+            elif compare_roles:
+                with st.spinner("Thinking as selected roles..."):
+                    history_for_api = windowed_history()
+
+                    async def _generate_all():
+                        loop = asyncio.get_running_loop()
+                        # 없는 아바타들은 LLM 호출과 겹쳐서 미리 받아온다
+                        avatar_futs = {
+                            r: loop.run_in_executor(None, get_avatar_emoji)
+                            for r in compare_roles
+                            if r not in st.session_state.avatar_cache
+                        }
+                        answers = await ask_roles(
+                            api_key,
+                            model_name,
+                            clean_input,
+                            history_for_api,
+                            roles=compare_roles,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                        )
+                        avatars = {r: await f for r, f in avatar_futs.items()}
+                        return answers, avatars
+
+                    try:
+                        answers, new_avatars = asyncio.run(_generate_all())
+                        st.session_state.avatar_cache.update(new_avatars)
+                    except RuntimeError as e:
+                        st.error(str(e))
+                        answers = None
+
+                    if answers:
+                        user_msg = {
+                            "role": "user",
+                            "content": clean_input,
+                            "role_name": "You",
+                            "avatar": "",
+                        }
+                        append_message(user_msg)
+                        for r, ans in answers.items():
+                            bot_msg = {
+                                "role": "assistant",
+                                "content": ans,
+                                "role_name": r,
+                                "avatar": st.session_state.avatar_cache.get(
+                                    r, "🧑‍🎨"
+                                ),
+                            }
+                            append_message(bot_msg)
+                        st.session_state.last_variants = None
+                        # 히스토리 fragment까지 갱신해야 하므로 전체 rerun
+                        st.rerun()
+            elif n_variants > 1:
+                with st.spinner(f"Thinking as {role_name} ({n_variants} variants)..."):
+                    history_for_api = windowed_history()
+                    avatar = st.session_state.avatar_cache.get(role_name)
+
+                    async def _generate_variants(need_avatar: bool):
+                        loop = asyncio.get_running_loop()
+                        f_avatar = (
+                            loop.run_in_executor(None, get_avatar_emoji)
+                            if need_avatar
+                            else None
+                        )
+                        answers = await call_openai_chat_variants(
+                            api_key,
+                            model_name,
+                            role_info["system_prompt"],
+                            clean_input,
+                            history_for_api,
+                            n=n_variants,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                        )
+                        fetched = await f_avatar if f_avatar is not None else None
+                        return answers, fetched
+
+                    try:
+                        variants, fetched_avatar = asyncio.run(
+                            _generate_variants(avatar is None)
+                        )
+                        if fetched_avatar is not None:
+                            avatar = fetched_avatar
+                            st.session_state.avatar_cache[role_name] = avatar
+                    except RuntimeError as e:
+                        st.error(str(e))
+                        variants = None
+
+                    if variants:
+                        append_message(
+                            {
+                                "role": "user",
+                                "content": clean_input,
+                                "role_name": "You",
+                                "avatar": "",
+                            }
+                        )
+                        for ans in variants:
+                            append_message(
+                                {
+                                    "role": "assistant",
+                                    "content": ans,
+                                    "role_name": role_name,
+                                    "avatar": avatar,
+                                }
+                            )
+                        # 탭 렌더용으로 최신 변형 묶음을 세션에 기억
+                        st.session_state.last_variants = {
+                            "role_name": role_name,
+                            "avatar": avatar,
+                            "answers": variants,
+                        }
+                        st.rerun()
+            else:
+                with st.spinner(f"Thinking as {role_name}..."):
+                    # 아바타가 캐시에 없으면 OpenAI 스트리밍과 "동시에" 같은
+                    # 이벤트 루프에서 받아와서 EmojiHub 지연이 LLM 지연 뒤에 숨도록 한다.
+                    avatar = st.session_state.avatar_cache.get(role_name)
+
+                    # 이전 히스토리에서 role, content만 꺼내서 전달 (윈도우 적용)
+                    history_for_api = windowed_history()
+
+                    # 스트리밍: 토큰이 도착하는 대로 placeholder에 그림
+                    placeholder = st.empty()
+
+                    async def _consume_stream() -> str:
+                        parts: List[str] = []
+                        async for token in call_openai_chat(
+                            api_key=api_key,
+                            model=model_name,
+                            system_prompt=role_info["system_prompt"],
+                            user_message=clean_input,
+                            history=history_for_api,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                        ):
+                            parts.append(token)
+                            placeholder.markdown("".join(parts))
+                        return "".join(parts).strip()
+
+                    async def _interact(need_avatar: bool):
+                        """
+                        한 클릭의 비동기 작업 전부를 루프 하나에서 처리.
+                        (루프를 두 번 띄우면 클라이언트 커넥션 풀이 루프 사이에서
+                        공유되지 못하고, 호출들이 겹치지 못한 채 직렬화된다)
+                        아바타 fetch를 먼저 띄워 임베딩 조회/LLM 스트리밍과 겹치고,
+                        의미 캐시 히트면 스트리밍을 통째로 건너뛴다.
+                        """
+                        loop = asyncio.get_running_loop()
+                        avatar_task = (
+                            asyncio.ensure_future(
+                                loop.run_in_executor(None, get_avatar_emoji)
+                            )
+                            if need_avatar
+                            else None
+                        )
+                        try:
+                            sem_answer, query_embedding = await semantic_cache_lookup(
+                                api_key, model_name, role_name, clean_input
+                            )
+                            answer = (
+                                sem_answer
+                                if sem_answer is not None
+                                else await _consume_stream()
+                            )
+                        except BaseException:
+                            if avatar_task is not None:
+                                avatar_task.cancel()
+                            raise
+                        fetched = None
+                        if avatar_task is not None:
+                            try:
+                                fetched = await avatar_task
+                            except Exception:
+                                # 아바타 실패가 답변을 죽이면 안 된다
+                                fetched = "🧑‍🎨"
+                        return answer, fetched, query_embedding, sem_answer is not None
+
+                    # 같은 입력 조합이면 LLM 왕복 없이 캐시된 답변을 바로 사용
+                    answer_cache = get_answer_cache()
+                    cache_key = make_answer_cache_key(
+                        api_key,
+                        model_name,
+                        role_info["system_prompt"],
+                        clean_input,
+                        history_for_api,
+                        max_tokens,
+                        temperature,
+                    )
+                    answer = answer_cache.get(cache_key)
 
+                    if answer is not None:
+                        if avatar is None:
+                            avatar = get_avatar_emoji()
+                            st.session_state.avatar_cache[role_name] = avatar
+                    else:
+                        # exact-match 미스 → 의미 캐시 조회 + (미스 시) 스트리밍 +
+                        # 아바타 fetch를 asyncio.run 한 번으로 처리
+                        try:
+                            answer, fetched_avatar, query_embedding, semantic_hit = (
+                                asyncio.run(_interact(avatar is None))
+                            )
+                            placeholder.empty()
+                            if fetched_avatar is not None:
+                                avatar = fetched_avatar
+                                st.session_state.avatar_cache[role_name] = avatar
+                            if not semantic_hit:
+                                # mock 답변은 캐시에 안 남고, 크기는 FIFO로 바운드됨
+                                cache_answer(answer_cache, cache_key, answer)
+                                semantic_cache_store(
+                                    role_name, model_name, query_embedding, answer
+                                )
+                        except RuntimeError as e:
+                            st.error(str(e))
+                            answer = None
 
-# ------------------------------
-# 4. 말풍선 렌더 함수들
-# ------------------------------
-def render_user_bubble(text: str):
-    st.markdown(
-        f"""
-<div class="chat-container chat-user">
-  <div class="chat-bubble">
-    {text}
-  </div>
-</div>
-""",
-        unsafe_allow_html=True,
-    )
+                    if answer is not None:
+                        # 히스토리에 저장 (렌더용 HTML은 append 시점에 한 번만 조립)
+                        user_msg = {
+                            "role": "user",
+                            "content": clean_input,
+                            "role_name": "You",
+                            "avatar": "",
+                        }
+                        bot_msg = {
+                            "role": "assistant",
+                            "content": answer,
+                            "role_name": role_name,
+                            "avatar": avatar,
+                        }
+                        append_message(user_msg)
+                        append_message(bot_msg)
+                        st.session_state.last_variants = None
+                        # 히스토리 fragment까지 갱신해야 하므로 전체 rerun
+                        st.rerun()
+
+    # 가장 최근 응답을 메인 영역에도 크게 보여주기 (변형이 있으면 탭으로)
+    if st.session_state.chat_history:
+        variants_state = st.session_state.get("last_variants")
+        if variants_state:
+            st.markdown("### 💡 Latest response (variants)")
+            tabs = st.tabs(
+                [f"Variant {i + 1}" for i in range(len(variants_state["answers"]))]
+            )
+            for tab, ans in zip(tabs, variants_state["answers"]):
+                with tab:
+                    render_bot_bubble_main(
+                        ans,
+                        variants_state["role_name"],
+                        variants_state["avatar"],
+                    )
+        else:
+            last = st.session_state.chat_history[-1]
+            if last["role"] == "assistant":
+                st.markdown("### 💡 Latest response")
+                render_bot_bubble_main(
+                    last["content"],
+                    last["role_name"],
+                    last.get("avatar", "🧑‍🎨"),
+                )
 
 
-def render_bot_bubble_main(text: str, role_name: str, ascii_art: str, emoji_html: str):
-    """메인 영역의 최신 답변용 (전체 텍스트 다 보여줌)."""
-    st.markdown(
-        f"""
-<div class="chat-container chat-bot">
-  <div class="chat-bubble">
-    <div class="chat-bubble-inner">
-      <div class="chat-avatar">{emoji_html}</div>
-      <div class="chat-content">
-        <div class="chat-role-header">{role_name}</div>
-        <div class="chat-ascii">{ascii_art}</div>
-        <div>{text}</div>
-      </div>
-    </div>
-  </div>
-</div>
-""",
-        unsafe_allow_html=True,
-    )
+@st.fragment
+def history_panel():
+    """오른쪽 히스토리 영역. 히스토리가 변했을 때만 전체 rerun으로 갱신된다."""
+    st.subheader("Conversation History (bubble view)")
 
+    if not st.session_state.chat_history:
+        st.info("아직 대화가 없습니다. 질문을 한 번 해보세요!")
+    else:
+        # 메시지별 markdown 호출 대신 증분 blob 하나로 모아서 한 번만 emit
+        st.markdown(incremental_history_html(), unsafe_allow_html=True)
 
-def render_bot_bubble_history_preview(role_name: str, ascii_art: str, emoji_html: str):
-    """
-    히스토리 뷰에서 사용하는 '압축 버전' 말풍선.
-    - 아바타 + Role header + ASCII 아트만 보임
-    - 실제 긴 텍스트는 아래 expander에 따로 표시
-    """
-    st.markdown(
-        f"""
-<div class="chat-container chat-bot chat-history-bot">
-  <div class="chat-bubble">
-    <div class="chat-bubble-inner">
-      <div class="chat-avatar">{emoji_html}</div>
-      <div class="chat-content">
-        <div class="chat-role-header">{role_name}</div>
-        <div class="chat-ascii">{ascii_art}</div>
-      </div>
-    </div>
-  </div>
-</div>
-""",
-        unsafe_allow_html=True,
-    )
+    if st.button("Clear history"):
+        st.session_state.chat_history = []
+        st.session_state.api_history = []
+        st.session_state.last_variants = None
+        reset_history_cache()
+        # 메인 영역의 Latest response도 같이 지워야 하므로 전체 rerun
+        st.rerun()
 
 
-# ------------------------------
-# 5. Streamlit UI
-# ------------------------------
 def main():
     st.set_page_config(
         page_title="Role-based Creative Chatbot",
@@ -320,6 +371,14 @@ def main():
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = []  # {"role", "content", "role_name", "avatar"}
 
+    # API 전송용 {"role", "content"} 전용 히스토리 (chat_history와 나란히 쌓임)
+    if "api_history" not in st.session_state:
+        st.session_state.api_history = []
+
+    # Role별 아바타 캐시 (세션당 role마다 EmojiHub를 한 번만 호출)
+    if "avatar_cache" not in st.session_state:
+        st.session_state.avatar_cache = {}
+
     # -------- 사이드바: API & Role 설정 --------
     with st.sidebar:
         st.title("🔑 API & Role Settings")
@@ -332,18 +391,53 @@ def main():
 
         model_name = st.selectbox(
             "Model",
-            ["gpt-4.1-mini", "gpt-4.1"],
+            MODEL_NAMES,
             index=0,
             help="과제용이면 작은 모델(gpt-4.1-mini)로 충분해요.",
         )
 
         role_name = st.selectbox(
             "Choose a role",
-            list(ROLE_DEFINITIONS.keys()),
+            ROLE_NAMES,
             index=0,
         )
         role_info = ROLE_DEFINITIONS[role_name]
 
+        # 고르면 한 번의 질문을 선택한 role들에게 병렬로 물어본다
+        compare_roles = st.multiselect(
+            "Compare roles (optional)",
+            ROLE_NAMES,
+            default=[],
+            help="여러 role에게 동시에 물어봐요 (병렬 호출이라 1개 role과 비슷한 시간).",
+        )
+
+        # 2 이상이면 같은 질문의 변형 답변 n개를 요청 한 번으로 받아온다
+        n_variants = st.number_input(
+            "Answer variants",
+            min_value=1,
+            max_value=3,
+            value=1,
+            help="공유 프롬프트는 한 번만 보내고 n개의 변형 답변을 받아요 (ask all과는 별개).",
+        )
+
+        # 출력 토큰 생성은 직렬이라 답변 지연이 max_tokens에 거의 비례한다
+        max_tokens = st.slider(
+            "Max tokens",
+            min_value=128,
+            max_value=2048,
+            value=512,
+            step=128,
+            help="답변 길이 상한. 낮출수록 긴 답변이 빨리 끝나요.",
+        )
+        temperature = st.slider(
+            "Temperature",
+            min_value=0.0,
+            max_value=2.0,
+            value=0.7,
+            step=0.1,
+            help="높을수록 답변이 다양해지고, 낮을수록 일관적이에요.",
+        )
+
         st.markdown("**Role description**")
         st.info(role_info["short"])
 
@@ -357,106 +451,20 @@ def main():
     col_main, col_history = st.columns([2, 1])
 
     with col_main:
-        st.title("🎭 Role-based Creative Chatbot")
-        st.write("Select a creative role on the left and ask your question below.")
-
-        example_text = role_info["example"]
-        user_input = st.text_area(
-            "Enter your question or idea:",
-            value=f"e.g., {example_text}",
-            height=120,
+        latest_panel(
+            api_key,
+            model_name,
+            role_name,
+            role_info,
+            compare_roles,
+            n_variants,
+            max_tokens,
+            temperature,
         )
 
-        if st.button("Generate Response"):
-            if not api_key:
-                st.error("먼저 왼쪽에서 OpenAI API Key를 입력하세요.")
-            else:
-                clean_input = (
-                    "" if user_input.strip().startswith("e.g.,") else user_input.strip()
-                )
-                if not clean_input:
-                    st.warning("질문을 입력한 뒤 버튼을 눌러주세요.")
-                else:
-                    with st.spinner(f"Thinking as {role_name}..."):
-                        try:
-                            # 이전 히스토리에서 role, content만 꺼내서 전달
-                            history_for_api = [
-                                {"role": m["role"], "content": m["content"]}
-                                for m in st.session_state.chat_history
-                            ]
-                            answer = call_openai_chat(
-                                api_key=api_key,
-                                model=model_name,
-                                system_prompt=role_info["system_prompt"],
-                                user_message=clean_input,
-                                history=history_for_api,
-                            )
-                        except RuntimeError as e:
-                            st.error(str(e))
-                            answer = None
-
-                        if answer is not None:
-                            # 아바타 이모지 생성
-                            avatar = get_avatar_emoji()
-
-                            # 히스토리에 저장
-                            st.session_state.chat_history.append(
-                                {
-                                    "role": "user",
-                                    "content": clean_input,
-                                    "role_name": "You",
-                                    "avatar": "",
-                                }
-                            )
-                            st.session_state.chat_history.append(
-                                {
-                                    "role": "assistant",
-                                    "content": answer,
-                                    "role_name": role_name,
-                                    "avatar": avatar,
-                                }
-                            )
-
-        # 가장 최근 응답을 메인 영역에도 크게 보여주기
-        if st.session_state.chat_history:
-            last = st.session_state.chat_history[-1]
-            if last["role"] == "assistant":
-                st.markdown("### 💡 Latest response")
-                render_bot_bubble_main(
-                    last["content"],
-                    last["role_name"],
-                    ROLE_DEFINITIONS[last["role_name"]]["ascii"],
-                    last.get("avatar", "🧑‍🎨"),
-                )
-
-    # -------- 오른쪽: 전체 대화 히스토리 (compact bubble + expander) --------
+    # -------- 오른쪽: 전체 대화 히스토리 (compact bubble + <details>) --------
     with col_history:
-        st.subheader("Conversation History (bubble view)")
-
-        if not st.session_state.chat_history:
-            st.info("아직 대화가 없습니다. 질문을 한 번 해보세요!")
-        else:
-            for i, msg in enumerate(st.session_state.chat_history):
-                if msg["role"] == "user":
-                    render_user_bubble(msg["content"])
-                else:
-                    role_name_msg = msg["role_name"]
-                    ascii_art = ROLE_DEFINITIONS[role_name_msg]["ascii"]
-                    avatar = msg.get("avatar", "🧑‍🎨")
-
-                    # 1) 말풍선에는 아바타 + Role header + ASCII 아트까지만
-                    render_bot_bubble_history_preview(
-                        role_name_msg,
-                        ascii_art,
-                        avatar,
-                    )
-
-                    # 2) 실제 긴 답변은 펼치기(expander) 안에
-                    with st.expander("Show full answer"):
-                        st.markdown(msg["content"])
-
-        if st.button("Clear history"):
-            st.session_state.chat_history = []
+        history_panel()
 
 
 if __name__ == "__main__":